@@ -0,0 +1,184 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+def _fingerprint(value):
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def user_id_from_token(authorization):
+    """Return the userId from a Bearer token issued by the Node auth routes, or None.
+
+    Tokens are HS256 JWTs signed with JWT_SECRET (same default as routes/auth.js).
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    try:
+        header, payload, signature = authorization[len("Bearer "):].strip().split(".")
+        if json.loads(_b64decode(header)).get("alg") != "HS256":
+            return None
+        secret = os.getenv("JWT_SECRET", "your-secret-key").encode("utf-8")
+        expected = hmac.new(secret, f"{header}.{payload}".encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        claims = json.loads(_b64decode(payload))
+        if claims.get("exp") is not None and claims["exp"] < time.time():
+            return None
+        return str(claims["userId"]) if claims.get("userId") else None
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def resolve_session_id(authorization, requested_id, remote_addr):
+    """Key analysis sessions by the authenticated user; unauthenticated
+    session ids are scoped to the caller's address so they cannot reach
+    another user's session."""
+    user_id = user_id_from_token(authorization)
+    if user_id:
+        return f"user:{user_id}"
+    return f"anon:{remote_addr}:{requested_id or ''}"
+
+
+def resolve_client_id(authorization, remote_addr):
+    """Key usage budgets by the authenticated user, falling back to the
+    caller's address; a client-supplied id could be changed per request."""
+    user_id = user_id_from_token(authorization)
+    if user_id:
+        return f"user:{user_id}"
+    return remote_addr or "unknown"
+
+
+class AnalysisSessions:
+    """Per-user health_analysis sessions so repeated calls only send new entries.
+
+    A context is a dict such as {"foodLogs": [...], "activities": [...], "profile": {...}}.
+    List values are treated as entries; everything else (e.g. the profile) is
+    fingerprinted as a whole and forces a full analysis when it changes.
+    Entries added since the last analysis, and entries that dropped out of a
+    rolling window, are sent as a delta against a running summary.
+    """
+
+    def __init__(self, max_sessions=1000):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(context):
+        entries = {}
+        static = {}
+        for key, value in context.items():
+            if isinstance(value, list):
+                # A list of (hash, item) so identical entries (the same meal logged twice) all count
+                entries[key] = [(_fingerprint(item), item) for item in value]
+            else:
+                static[key] = value
+        return entries, _fingerprint(static)
+
+    @staticmethod
+    def _summarize(summary, key, items, sign=1):
+        """Add items to (or with sign=-1, remove them from) the running summary"""
+        section = summary.setdefault(key, {"count": 0, "totals": {}})
+        for item in items:
+            section["count"] += sign
+            if isinstance(item, dict):
+                for field, value in item.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        section["totals"][field] = round(section["totals"].get(field, 0) + sign * value, 6)
+
+    def plan(self, session_id, context):
+        """Decide how much of the context needs to go to the model.
+
+        Returns a dict with "mode" set to "unchanged", "delta" or "full",
+        "previous_response" (the last alerts for this session, or None) and,
+        unless unchanged, a "prompt_context" string to append to the query.
+        """
+        entries, static_fp = self._split(context)
+        entry_hashes = {key: Counter(h for h, _ in items) for key, items in entries.items()}
+        plan = {"fingerprint": _fingerprint(context), "static_fp": static_fp,
+                "entries": entries, "entry_hashes": entry_hashes}
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session = json.loads(json.dumps(session))
+
+        plan["previous_response"] = session["response"] if session is not None else None
+        if session is not None and session["fingerprint"] == plan["fingerprint"]:
+            plan["mode"] = "unchanged"
+            return plan
+
+        if session is None or session["static_fp"] != static_fp:
+            plan.update(mode="full", summary={},
+                        prompt_context=f"Health data: {json.dumps(context, default=str)}")
+            return plan
+
+        new_entries = {}
+        dropped_entries = {}
+        for key in set(entries) | set(session["entry_hashes"]):
+            remaining = Counter(session["entry_hashes"].get(key, {}))
+            for h, item in entries.get(key, []):
+                if remaining[h] > 0:
+                    remaining[h] -= 1
+                else:
+                    new_entries.setdefault(key, []).append(item)
+            for h, count in remaining.items():
+                if count > 0:
+                    dropped_entries.setdefault(key, []).extend([session["entry_items"][key][h]] * count)
+        if not new_entries and not dropped_entries:
+            plan["mode"] = "unchanged"
+            return plan
+
+        summary = session["summary"]
+        for key, items in dropped_entries.items():
+            self._summarize(summary, key, items, sign=-1)
+        prompt_context = (
+            f"Summary of previously analysed data still in the window: {json.dumps(summary)}\n"
+            f"Previous alerts: {session['response']}\n"
+        )
+        if new_entries:
+            prompt_context += f"New entries since the last analysis: {json.dumps(new_entries, default=str)}\n"
+        if dropped_entries:
+            prompt_context += f"Entries no longer in the window: {json.dumps(dropped_entries, default=str)}\n"
+        prompt_context += "Return the complete, updated alert set in the same format, taking these changes into account."
+        plan.update(mode="delta", summary=summary, new_entries=new_entries,
+                    dropped_entries=dropped_entries, prompt_context=prompt_context)
+        return plan
+
+    def commit(self, session_id, plan, ai_response):
+        """Store the analysed context and the resulting alerts for the next call"""
+        if plan["mode"] == "unchanged":
+            return
+        summary = json.loads(json.dumps(plan["summary"]))
+        added = plan["new_entries"] if plan["mode"] == "delta" else {
+            key: [item for _, item in items] for key, items in plan["entries"].items()
+        }
+        for key, items in added.items():
+            self._summarize(summary, key, items)
+
+        state = {
+            "fingerprint": plan["fingerprint"],
+            "static_fp": plan["static_fp"],
+            "entry_hashes": {key: dict(hashes) for key, hashes in plan["entry_hashes"].items()},
+            # Items by hash, to take dropped entries back out of the summary
+            "entry_items": {key: dict(items) for key, items in plan["entries"].items()},
+            "summary": summary,
+            "response": ai_response,
+        }
+        with self._lock:
+            self._sessions[session_id] = state
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
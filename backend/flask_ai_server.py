@@ -4,68 +4,95 @@ import google.generativeai as genai
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
+from response_cache import ResponseCache
+from analysis_sessions import AnalysisSessions, resolve_client_id, resolve_session_id
+from request_scheduler import RequestScheduler, SchedulerBusy, lane_for
+from traffic_capture import TrafficCapture
+from llm_backends import BackendRouter
+from usage_tracker import UsageTracker, BudgetExhausted
 
 # Load environment variables
 load_dotenv()
 
-# Configure API key
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    print("ERROR: GEMINI_API_KEY not found in .env file")
-    exit(1)
-
-# Configure the Gemini model
-try:
-    genai.configure(api_key=api_key)
-    # Try different model names in order of preference
-    model_names = [
-        "gemini-pro",
-        "gemini-1.0-pro", 
-        "models/gemini-pro",
-        "gemini-1.5-flash"
-    ]
-    
-    model = None
-    for model_name in model_names:
-        try:
-            model = genai.GenerativeModel('gemini-2.5-pro')
-            # Test the model with a simple query
-            test_response = model.generate_content("Hello")
-            print(f"Successfully configured Gemini model: {model_name}")
-            break
-        except Exception as model_error:
-            print(f"Model {model_name} failed: {model_error}")
-            continue
-    
-    if model is None:
-        print("ERROR: No working Gemini model found")
+def configure_gemini():
+    """Configure the Gemini API and return a working model"""
+    # Configure API key
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("ERROR: GEMINI_API_KEY not found in .env file")
+        exit(1)
+
+    # Configure the Gemini model
+    try:
+        genai.configure(api_key=api_key)
+        # Try different model names in order of preference
+        model_names = [
+            "gemini-pro",
+            "gemini-1.0-pro", 
+            "models/gemini-pro",
+            "gemini-1.5-flash"
+        ]
+
+        model = None
+        for model_name in model_names:
+            try:
+                model = genai.GenerativeModel('gemini-2.5-pro')
+                # Test the model with a simple query
+                test_response = model.generate_content("Hello")
+                print(f"Successfully configured Gemini model: {model_name}")
+                break
+            except Exception as model_error:
+                print(f"Model {model_name} failed: {model_error}")
+                continue
+
+        if model is None:
+            print("ERROR: No working Gemini model found")
+            exit(1)
+
+    except Exception as e:
+        print(f"ERROR configuring Gemini API: {e}")
         exit(1)
-        
-except Exception as e:
-    print(f"ERROR configuring Gemini API: {e}")
-    exit(1)
+
+    return model
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
+# Opt-in request/upstream capture for offline replay and profiling
+traffic_capture = TrafficCapture.from_env()
+traffic_capture.install(app)
+
+# Last good response per request, served stale when Gemini is unavailable
+response_cache = ResponseCache()
+
+# Token usage per request type, model and client, persisted across restarts
+usage_tracker = UsageTracker(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'usage_stats.json'))
+
+# Per-user health_analysis sessions so repeated calls only send new entries
+analysis_sessions = AnalysisSessions()
+
+# Priority lanes so interactive questions keep upstream capacity during background analysis
+request_scheduler = RequestScheduler()
+
+# Pick the LLM backend (Gemini, the offline local backend or a replayed capture) and route calls
+# through the budget, priority lanes and capture
+ai_router = BackendRouter.from_env(configure_gemini, "gemini-1.5-flash", usage_tracker=usage_tracker,
+                                   scheduler=request_scheduler, capture=traffic_capture)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok", "message": "Gemini AI Flask Server is running"})
 
 @app.route('/test-ai', methods=['GET'])
 def test_ai():
-    """Test endpoint to verify Gemini AI is working"""
+    """Test endpoint to verify the AI backend is working"""
     try:
-        test_response = model.generate_content("Say 'Hello, AI is working!' in exactly 5 words.")
-        # Safely extract text
-        if test_response and test_response.candidates:
-            ai_text = test_response.candidates[0].content.parts[0].text
-        else:
-            ai_text = "No response"
+        test_result = ai_router.backend.generate("Say 'Hello, AI is working!' in exactly 5 words.")
         return jsonify({
             "status": "success",
             "message": "AI is working",
-            "test_response": ai_text
+            "backend": test_result.model_name,
+            "test_response": test_result.text
         })
     except Exception as e:
         return jsonify({
@@ -73,12 +100,22 @@ def test_ai():
             "message": f"AI test failed: {str(e)}"
         }), 500
 
+@app.route('/api/ai/usage', methods=['GET'])
+def ai_usage():
+    """Token usage, cost and budget counters"""
+    return jsonify(usage_tracker.snapshot())
+
+@app.route('/api/ai/queues', methods=['GET'])
+def ai_queues():
+    """Per-lane queue depth and wait time metrics"""
+    return jsonify(request_scheduler.metrics())
+
 @app.route('/api/ai/health-advice', methods=['OPTIONS'])
 def handle_preflight():
     headers = {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type'
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization'
     }
     return '', 200, headers
 
@@ -87,7 +124,7 @@ def health_advice():
     headers = {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type'
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization'
     }
 
     try:
@@ -104,8 +141,24 @@ def health_advice():
 
         query = data['query']
         request_type = data.get('type', 'general')
+        lane = lane_for(request_type, data.get('priority'))
+        client = resolve_client_id(request.headers.get('Authorization'), request.remote_addr)
         print(f"Received {request_type} query: {query[:100]}...")
 
+        # Only send entries the model has not analysed yet for this user
+        analysis_plan = None
+        cache_query = query
+        if request_type == 'health_analysis' and isinstance(data.get('context'), dict):
+            session_id = resolve_session_id(request.headers.get('Authorization'), data.get('session_id'), request.remote_addr)
+            # Key the stale cache on the session; the prompt context changes every call
+            cache_query = f"{session_id}:{query}"
+            analysis_plan = analysis_sessions.plan(session_id, data['context'])
+            if analysis_plan['mode'] == 'unchanged':
+                print(f"Health data unchanged for session {session_id}, returning previous analysis")
+                return jsonify({"response": analysis_plan['previous_response'], "unchanged": True}), 200, headers
+            print(f"Running {analysis_plan['mode']} analysis for session {session_id}")
+            query = f"{query}\n\n{analysis_plan['prompt_context']}"
+
         # Create appropriate prompts based on request type
         if request_type == 'suggestions':
             prompt = f"""As a health AI assistant, provide 4 brief health suggestions based on this context: {query}
@@ -133,27 +186,51 @@ Keep under 100 words."""
         print(f"Sending prompt to Gemini...")
 
         # Generate response with error handling
+        cache_key = response_cache.make_key(request_type, cache_query)
         try:
-            response = model.generate_content(prompt)
-            
-            if not response:
-                raise Exception("Empty response from model")
-                
-            if not response.candidates:
-                raise Exception("No candidates in response")
-                
-            if not response.candidates[0].content.parts:
-                raise Exception("No content parts in response")
+            def generate_fresh():
+                fresh = ai_router.generate(prompt, request_type, client, lane).text
+                if analysis_plan:
+                    analysis_sessions.commit(session_id, analysis_plan, fresh)
+                return fresh
 
-            ai_response = response.candidates[0].content.parts[0].text
+            # A slow upstream call gets a bounded wait, then the last good answer is served
+            ai_response, stale_entry = response_cache.fetch(cache_key, generate_fresh)
+            if stale_entry:
+                return jsonify({
+                    "response": stale_entry["response"],
+                    "stale": True,
+                    "cached_at": stale_entry["stored_at"]
+                }), 200, headers
             print(f"Gemini response received: {len(ai_response)} characters")
-            
+
             return jsonify({"response": ai_response}), 200, headers
 
         except Exception as api_error:
             error_str = str(api_error).lower()
             print(f"Gemini API error: {api_error}")
 
+            # For analysis, the session's last alerts are the last good answer
+            if analysis_plan and analysis_plan['previous_response']:
+                return jsonify({"response": analysis_plan['previous_response'], "stale": True}), 200, headers
+
+            # Serve the last good answer for this request and refresh it in the background
+            cached = response_cache.get(cache_key)
+            if cached:
+                # Deferred or over-budget work is shed, not retried in another thread
+                if not analysis_plan and not isinstance(api_error, (BudgetExhausted, SchedulerBusy)):
+                    response_cache.refresh_async(cache_key, lambda: ai_router.generate(prompt, request_type, client).text)
+                return jsonify({
+                    "response": cached["response"],
+                    "stale": True,
+                    "cached_at": cached["stored_at"]
+                }), 200, headers
+
+            # Answer from the offline backend before falling back to canned text
+            if ai_router.backend is not ai_router.local_backend:
+                degraded = ai_router.local_backend.generate(prompt)
+                return jsonify({"response": degraded.text, "degraded": True}), 200, headers
+
             # Provide fallback responses based on request type
             if request_type == 'suggestions':
                 fallback_response = """NUTRITION: Eat balanced meals with fruits and vegetables
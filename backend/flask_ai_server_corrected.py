@@ -5,24 +5,34 @@ import google.generativeai as genai
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
+from response_cache import ResponseCache
+from analysis_sessions import AnalysisSessions, resolve_client_id, resolve_session_id
+from request_scheduler import RequestScheduler, SchedulerBusy, lane_for
+from traffic_capture import TrafficCapture
+from llm_backends import BackendRouter
+from usage_tracker import UsageTracker, BudgetExhausted
 
 # Load environment variables
 load_dotenv()
 
-# Configure API key
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    print("ERROR: GEMINI_API_KEY not found in .env file")
-    exit(1)
-
-# Configure the Gemini model (simple configuration)
-try:
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    print("Gemini API configured successfully")
-except Exception as e:
-    print(f"ERROR configuring Gemini API: {e}")
-    exit(1)
+def configure_gemini():
+    """Configure the Gemini API and return the model"""
+    # Configure API key
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("ERROR: GEMINI_API_KEY not found in .env file")
+        exit(1)
+
+    # Configure the Gemini model (simple configuration)
+    try:
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel('gemini-1.5-flash')
+        print("Gemini API configured successfully")
+    except Exception as e:
+        print(f"ERROR configuring Gemini API: {e}")
+        exit(1)
+
+    return model
 
 def find_available_port(start_port=5050):
     """Find an available port starting from start_port"""
@@ -38,19 +48,41 @@ def find_available_port(start_port=5050):
 app = Flask(__name__)
 CORS(app)
 
+# Opt-in request/upstream capture for offline replay and profiling
+traffic_capture = TrafficCapture.from_env()
+traffic_capture.install(app)
+
+# Last good response per request, served stale when Gemini is unavailable
+response_cache = ResponseCache()
+
+# Token usage per request type, model and client, persisted across restarts
+usage_tracker = UsageTracker(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'usage_stats.json'))
+
+# Per-user health_analysis sessions so repeated calls only send new entries
+analysis_sessions = AnalysisSessions()
+
+# Priority lanes so interactive questions keep upstream capacity during background analysis
+request_scheduler = RequestScheduler()
+
+# Pick the LLM backend (Gemini, the offline local backend or a replayed capture) and route calls
+# through the budget, priority lanes and capture
+ai_router = BackendRouter.from_env(configure_gemini, "gemini-1.5-flash-8b", usage_tracker=usage_tracker,
+                                   scheduler=request_scheduler, capture=traffic_capture)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok", "message": "Gemini AI Flask Server is running"})
 
 @app.route('/test-ai', methods=['GET'])
 def test_ai():
-    """Test endpoint to verify Gemini AI is working"""
+    """Test endpoint to verify the AI backend is working"""
     try:
-        test_response = model.generate_content("Say 'Hello, AI is working!' in exactly 5 words.")
+        test_result = ai_router.backend.generate("Say 'Hello, AI is working!' in exactly 5 words.")
         return jsonify({
             "status": "success", 
             "message": "AI is working",
-            "response": test_response.text
+            "backend": test_result.model_name,
+            "response": test_result.text
         })
     except Exception as e:
         return jsonify({
@@ -58,8 +90,24 @@ def test_ai():
             "message": f"AI test failed: {str(e)}"
         }), 500
 
+@app.route('/api/ai/usage', methods=['GET'])
+def ai_usage():
+    """Token usage, cost and budget counters"""
+    return jsonify(usage_tracker.snapshot())
+
+@app.route('/api/ai/queues', methods=['GET'])
+def ai_queues():
+    """Per-lane queue depth and wait time metrics"""
+    return jsonify(request_scheduler.metrics())
+
 @app.route('/api/ai/health-advice', methods=['POST'])
 def health_advice():
+    query = ''
+    request_type = 'general'
+    prompt = None
+    analysis_plan = None
+    cache_query = ''
+    client = resolve_client_id(request.headers.get('Authorization'), request.remote_addr)
     try:
         data = request.json
         if not data or 'query' not in data:
@@ -67,7 +115,26 @@ def health_advice():
 
         query = data['query']
         request_type = data.get('type', 'general')
+        cache_query = query
+        lane = lane_for(request_type, data.get('priority'))
         print(f"Received {request_type} query: {query[:100]}...")
+
+        # Only send entries the model has not analysed yet for this user
+        if request_type == 'health_analysis' and isinstance(data.get('context'), dict):
+            session_id = resolve_session_id(request.headers.get('Authorization'), data.get('session_id'), request.remote_addr)
+            # Key the stale cache on the session; the prompt context changes every call
+            cache_query = f"{session_id}:{query}"
+            analysis_plan = analysis_sessions.plan(session_id, data['context'])
+            if analysis_plan['mode'] == 'unchanged':
+                print(f"Health data unchanged for session {session_id}, returning previous analysis")
+                return jsonify({
+                    "response": analysis_plan['previous_response'],
+                    "type": request_type,
+                    "query": query,
+                    "unchanged": True
+                })
+            print(f"Running {analysis_plan['mode']} analysis for session {session_id}")
+            query = f"{query}\n\n{analysis_plan['prompt_context']}"
         
         # Simple prompt generation based on type
         if request_type == 'suggestions':
@@ -96,8 +163,22 @@ If no concerns, respond exactly: NO_ALERTS_NEEDED"""
         print(f"Sending prompt to Gemini...")
         
         # Generate AI response
-        response = model.generate_content(prompt)
-        ai_response = response.text.strip()
+        def generate_fresh():
+            fresh = ai_router.generate(prompt, request_type, client, lane).text.strip()
+            if analysis_plan:
+                analysis_sessions.commit(session_id, analysis_plan, fresh)
+            return fresh
+
+        # A slow upstream call gets a bounded wait, then the last good answer is served
+        ai_response, stale_entry = response_cache.fetch(response_cache.make_key(request_type, cache_query), generate_fresh)
+        if stale_entry:
+            return jsonify({
+                "response": stale_entry["response"],
+                "type": request_type,
+                "query": query,
+                "stale": True,
+                "cached_at": stale_entry["stored_at"]
+            })
         
         print(f"Gemini response: {ai_response[:100]}...")
         
@@ -111,6 +192,43 @@ If no concerns, respond exactly: NO_ALERTS_NEEDED"""
         print(f"Error: {e}")
         error_message = str(e)
         
+        # For analysis, the session's last alerts are the last good answer
+        if analysis_plan and analysis_plan['previous_response']:
+            return jsonify({
+                "response": analysis_plan['previous_response'],
+                "type": request_type,
+                "query": query,
+                "stale": True,
+                "error": error_message
+            })
+        
+        # Serve the last good answer for this request and refresh it in the background
+        cache_key = response_cache.make_key(request_type, cache_query)
+        cached = response_cache.get(cache_key)
+        if cached:
+            # Deferred or over-budget work is shed, not retried in another thread
+            if prompt and not analysis_plan and not isinstance(e, (BudgetExhausted, SchedulerBusy)):
+                response_cache.refresh_async(cache_key, lambda: ai_router.generate(prompt, request_type, client).text.strip())
+            return jsonify({
+                "response": cached["response"],
+                "type": request_type,
+                "query": query,
+                "stale": True,
+                "cached_at": cached["stored_at"],
+                "error": error_message
+            })
+        
+        # Answer from the offline backend before falling back to canned text
+        if prompt and ai_router.backend is not ai_router.local_backend:
+            degraded = ai_router.local_backend.generate(prompt)
+            return jsonify({
+                "response": degraded.text.strip(),
+                "type": request_type,
+                "query": query,
+                "degraded": True,
+                "error": error_message
+            })
+        
         # Provide appropriate fallbacks
         if request_type == 'suggestions':
             fallback = """NUTRITION: Eat colorful fruits and vegetables daily
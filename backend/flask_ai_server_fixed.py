@@ -4,66 +4,80 @@ import google.generativeai as genai
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
+from traffic_capture import TrafficCapture
+from llm_backends import BackendRouter
 
 # Load environment variables
 load_dotenv()
 
-# Configure API key
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    print("ERROR: GEMINI_API_KEY not found in .env file")
-    exit(1)
-
-print(f"API Key loaded: {api_key[:10]}...{api_key[-5:] if len(api_key) > 15 else api_key}")
-if len(api_key) < 30:
-    print("WARNING: API key seems too short. Typical Gemini API keys are longer.")
-    print("Please check your API key at: https://makersuite.google.com/app/apikey")
-
-# Configure the Gemini model
-try:
-    genai.configure(api_key=api_key)
-    # Try different model names - gemini-1.5-flash might be deprecated
-    model_names = [
-        'gemini-1.5-flash-latest',
-        'gemini-1.5-flash-002', 
-        'gemini-1.5-flash',
-        'gemini-pro',
-        'gemini-1.0-pro'
-    ]
-    
-    model = None
-    for model_name in model_names:
-        try:
-            model = genai.GenerativeModel(model_name)
-            print(f"Successfully configured Gemini model: {model_name}")
-            break
-        except Exception as model_error:
-            print(f"Failed to load model {model_name}: {model_error}")
-            continue
-    
-    if model is None:
-        raise Exception("No working Gemini model found")
-        
-except Exception as e:
-    print(f"ERROR configuring Gemini API: {e}")
-    exit(1)
+def configure_gemini():
+    """Configure the Gemini API and return the first model that loads"""
+    # Configure API key
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("ERROR: GEMINI_API_KEY not found in .env file")
+        exit(1)
+
+    print(f"API Key loaded: {api_key[:10]}...{api_key[-5:] if len(api_key) > 15 else api_key}")
+    if len(api_key) < 30:
+        print("WARNING: API key seems too short. Typical Gemini API keys are longer.")
+        print("Please check your API key at: https://makersuite.google.com/app/apikey")
+
+    # Configure the Gemini model
+    try:
+        genai.configure(api_key=api_key)
+        # Try different model names - gemini-1.5-flash might be deprecated
+        model_names = [
+            'gemini-1.5-flash-latest',
+            'gemini-1.5-flash-002', 
+            'gemini-1.5-flash',
+            'gemini-pro',
+            'gemini-1.0-pro'
+        ]
+
+        model = None
+        for model_name in model_names:
+            try:
+                model = genai.GenerativeModel(model_name)
+                print(f"Successfully configured Gemini model: {model_name}")
+                break
+            except Exception as model_error:
+                print(f"Failed to load model {model_name}: {model_error}")
+                continue
+
+        if model is None:
+            raise Exception("No working Gemini model found")
+
+    except Exception as e:
+        print(f"ERROR configuring Gemini API: {e}")
+        exit(1)
+
+    return model
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
+# Opt-in request/upstream capture for offline replay and profiling
+traffic_capture = TrafficCapture.from_env()
+traffic_capture.install(app)
+
+# Pick the LLM backend (Gemini, the offline local backend or a replayed capture)
+ai_router = BackendRouter.from_env(configure_gemini, capture=traffic_capture)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok", "message": "Gemini AI Flask Server is running"})
 
 @app.route('/test-ai', methods=['GET'])
 def test_ai():
-    """Test endpoint to verify Gemini AI is working"""
+    """Test endpoint to verify the AI backend is working"""
     try:
-        test_response = model.generate_content("Say 'Hello, AI is working!' in exactly 5 words.")
+        test_result = ai_router.backend.generate("Say 'Hello, AI is working!' in exactly 5 words.")
         return jsonify({
             "status": "success", 
             "message": "AI is working",
-            "test_response": test_response.text
+            "backend": test_result.model_name,
+            "test_response": test_result.text
         })
     except Exception as e:
         return jsonify({
@@ -152,12 +166,12 @@ Only create alerts for actual health issues that need attention."""
         # Generate response from Gemini
         try:
             print(f"Generating content with model...")
-            response = model.generate_content(prompt)
+            result = ai_router.generate(prompt, request_type)
             
-            if not response or not response.text:
+            if not result.text:
                 return jsonify({"error": "Empty response from AI model"}), 500, headers
                 
-            ai_response = response.text
+            ai_response = result.text
             print(f"Gemini response: {ai_response[:200]}...")
             return jsonify({"response": ai_response}), 200, headers
             
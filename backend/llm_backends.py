@@ -0,0 +1,308 @@
+import asyncio
+import os
+import re
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import Counter, deque
+
+from request_scheduler import LANE_BACKGROUND
+from usage_tracker import BudgetExhausted, MODE_CACHE_ONLY, MODE_DOWNGRADE, estimate_tokens, extract_usage
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+class GenerationResult:
+    """Text from a backend together with its usage metadata"""
+
+    def __init__(self, text, model_name, input_tokens, output_tokens, estimated=False, latency_ms=0.0):
+        self.text = text
+        self.model_name = model_name
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.estimated = estimated
+        self.latency_ms = latency_ms
+
+
+class LLMBackend(ABC):
+    """Interface the AI servers call instead of a specific model SDK.
+
+    Subclasses implement generate(); async and streaming calls fall back to it.
+    """
+
+    name = "base"
+    # Whether calls go to a rate-limited upstream service and need scheduling
+    uses_upstream = True
+
+    @abstractmethod
+    def generate(self, prompt):
+        """Return a GenerationResult for prompt"""
+
+    async def agenerate(self, prompt):
+        return await asyncio.to_thread(self.generate, prompt)
+
+    def stream(self, prompt):
+        """Yield the response text in chunks"""
+        yield self.generate(prompt).text
+
+
+class GeminiBackend(LLMBackend):
+    """Wraps a google.generativeai GenerativeModel, or anything with the same
+    generate_content interface such as traffic_capture.ReplayModel."""
+
+    name = "gemini"
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def model_name(self):
+        return getattr(self.model, "model_name", self.name)
+
+    def _result(self, prompt, response, started):
+        if not response:
+            raise Exception("Empty response from model")
+
+        if not response.candidates:
+            raise Exception("No candidates in response")
+
+        if not response.candidates[0].content.parts:
+            raise Exception("No content parts in response")
+
+        text = response.candidates[0].content.parts[0].text
+        input_tokens, output_tokens, estimated = extract_usage(response, prompt, text)
+        return GenerationResult(text, self.model_name, input_tokens, output_tokens, estimated,
+                                (time.time() - started) * 1000)
+
+    def generate(self, prompt):
+        started = time.time()
+        return self._result(prompt, self.model.generate_content(prompt), started)
+
+    async def agenerate(self, prompt):
+        if not hasattr(self.model, "generate_content_async"):
+            return await super().agenerate(prompt)
+        started = time.time()
+        return self._result(prompt, await self.model.generate_content_async(prompt), started)
+
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            if chunk.candidates and chunk.candidates[0].content.parts:
+                yield chunk.candidates[0].content.parts[0].text
+
+
+def infer_request_type(prompt):
+    """Recover the request type from the response format a prompt asks for"""
+    if "NUTRITION:" in prompt:
+        return "suggestions"
+    if "NO_ALERTS_NEEDED" in prompt:
+        return "health_analysis"
+    return "general"
+
+
+def _features(text):
+    words = WORD_RE.findall(text.lower())
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+class LocalBackend(LLMBackend):
+    """Offline backend answering from past responses to similar prompts.
+
+    Prompts are compared by word unigram/bigram overlap (Jaccard), ignoring
+    n-grams shared by most seeds of the same request type (the prompt
+    template). The best past response is returned if it is similar enough.
+    Scanning stops at max_latency_ms, keeping the best match found so far.
+
+    Only general questions are learned and retrieved: suggestions and health
+    analysis prompts embed one user's data, so their answers must not be
+    served to anyone else. Those types, and general questions with no close
+    seed, get a fixed template answer in the format the servers parse, so
+    the same prompt always gets the same answer.
+    """
+
+    name = "local"
+    uses_upstream = False
+
+    RETRIEVED_TYPES = {"general"}
+    MIN_SIMILARITY = 0.35
+    TEMPLATES = {
+        "suggestions": (
+            "NUTRITION: Fill half your plate with vegetables and fruit at each meal\n"
+            "HYDRATION: Drink a glass of water with every meal and snack\n"
+            "EXERCISE: Take a brisk 10-minute walk after your next meal\n"
+            "GENERAL: Aim for 7-8 hours of sleep at regular times"
+        ),
+        "health_analysis": "NO_ALERTS_NEEDED",
+        "general": "🍎 Eat whole foods, stay hydrated, keep active and ask a healthcare professional about specific concerns.",
+    }
+
+    def __init__(self, max_seeds=500, max_latency_ms=50.0):
+        self.max_seeds = max_seeds
+        self.max_latency_ms = max_latency_ms
+        self._seeds = {}
+        self._doc_freq = {}
+        self._common = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Built from AI_LOCAL_MAX_LATENCY_MS and seeded from AI_LOCAL_SEED_FILE if set"""
+        local_backend = cls(max_latency_ms=float(os.getenv("AI_LOCAL_MAX_LATENCY_MS", "50")))
+        if os.getenv("AI_LOCAL_SEED_FILE"):
+            local_backend.load_capture(os.getenv("AI_LOCAL_SEED_FILE"))
+        return local_backend
+
+    def learn(self, prompt, text):
+        """Add a prompt/response pair to the seed corpus"""
+        if not prompt or not text:
+            return
+        request_type = infer_request_type(prompt)
+        if request_type not in self.RETRIEVED_TYPES:
+            return
+        features = _features(prompt)
+        with self._lock:
+            seeds = self._seeds.setdefault(request_type, deque())
+            doc_freq = self._doc_freq.setdefault(request_type, Counter())
+            if len(seeds) >= self.max_seeds:
+                old_features, _ = seeds.popleft()
+                doc_freq.subtract(old_features)
+            seeds.append((features, text))
+            doc_freq.update(features)
+            self._common.pop(request_type, None)
+
+    def load_capture(self, path):
+        """Seed from a traffic capture file written with prompts (AI_CAPTURE_FILE)"""
+        from traffic_capture import load_capture
+
+        learned = 0
+        for record in load_capture(path):
+            for upstream in record.get("up", []):
+                if upstream.get("p"):
+                    self.learn(upstream["p"], upstream["r"])
+                    learned += 1
+        print(f"Local backend learned {learned} responses from {path}")
+
+    def _template(self, prompt, request_type, started):
+        text = self.TEMPLATES[request_type]
+        return GenerationResult(text, self.name, estimate_tokens(prompt), estimate_tokens(text),
+                                True, (time.time() - started) * 1000)
+
+    def generate(self, prompt):
+        started = time.time()
+        deadline = started + self.max_latency_ms / 1000
+        request_type = infer_request_type(prompt)
+        if request_type not in self.RETRIEVED_TYPES:
+            return self._template(prompt, request_type, started)
+        with self._lock:
+            seeds = list(self._seeds.get(request_type, ()))
+            # N-grams in most seeds are template text; with a single seed it
+            # cannot be told apart, so a near match is required instead
+            common = self._common.get(request_type)
+            if common is None:
+                doc_freq = self._doc_freq.get(request_type, Counter())
+                common = {f for f, count in doc_freq.items() if count > len(seeds) / 2} if len(seeds) > 1 else set()
+                self._common[request_type] = common
+        min_similarity = self.MIN_SIMILARITY if len(seeds) > 1 else 0.9
+
+        query = _features(prompt) - common
+        best_text, best_score = None, 0.0
+        for features, text in reversed(seeds):
+            candidate = features - common
+            union = len(query | candidate)
+            score = len(query & candidate) / union if union else 0.0
+            if score > best_score:
+                best_text, best_score = text, score
+            if time.time() > deadline:
+                break
+
+        if best_text is None or best_score < min_similarity:
+            return self._template(prompt, request_type, started)
+        return GenerationResult(best_text, self.name, estimate_tokens(prompt), estimate_tokens(best_text),
+                                True, (time.time() - started) * 1000)
+
+
+class BackendRouter:
+    """Sends each prompt to the backend the daily budget allows.
+
+    Upstream calls hold a scheduler slot in their lane and teach the local
+    backend; every call is recorded in the usage tracker and the traffic
+    capture. Each of those steps is skipped when its object is not given.
+    Near the budget the fallback backend answers; once the budget is spent
+    only a local fallback may answer, otherwise BudgetExhausted is raised.
+    """
+
+    def __init__(self, backend, local_backend, fallback_backend=None, usage_tracker=None,
+                 scheduler=None, capture=None):
+        self.backend = backend
+        self.local_backend = local_backend
+        self.fallback_backend = fallback_backend
+        self.usage_tracker = usage_tracker
+        self.scheduler = scheduler
+        self.capture = capture
+
+    @classmethod
+    def from_env(cls, configure_gemini, default_fallback_model=None, **kwargs):
+        """Pick backends from the environment.
+
+          AI_REPLAY_FILE        - answer from a traffic capture (see replay_traffic.py)
+          AI_BACKEND=local      - answer offline from the local backend
+          GEMINI_FALLBACK_MODEL - Gemini model, or "local", used near the budget
+
+        Otherwise configure_gemini() is called and must return a Gemini model.
+        """
+        local_backend = LocalBackend.from_env()
+        replay_file = os.getenv("AI_REPLAY_FILE")
+        if replay_file:
+            from traffic_capture import ReplayModel
+
+            backend = GeminiBackend(ReplayModel(replay_file, float(os.getenv("AI_REPLAY_UPSTREAM_SPEED", "1.0"))))
+            print(f"Replaying upstream responses from {replay_file}")
+            # A replayed capture has no cheaper model to downgrade to
+            return cls(backend, local_backend, backend, **kwargs)
+        if os.getenv("AI_BACKEND", "gemini") == "local":
+            print("Using offline local backend")
+            return cls(local_backend, local_backend, local_backend, **kwargs)
+
+        backend = GeminiBackend(configure_gemini())
+        fallback_model_name = os.getenv("GEMINI_FALLBACK_MODEL", default_fallback_model)
+        if fallback_model_name == "local":
+            fallback_backend = local_backend
+        elif fallback_model_name:
+            import google.generativeai as genai
+
+            fallback_backend = GeminiBackend(genai.GenerativeModel(fallback_model_name))
+        else:
+            fallback_backend = None
+        return cls(backend, local_backend, fallback_backend, **kwargs)
+
+    def select(self, client):
+        """Pick the backend allowed by the remaining daily budget"""
+        # Backends without an upstream cost nothing, so budgets do not apply
+        if not self.backend.uses_upstream or self.usage_tracker is None:
+            return self.backend
+        mode = self.usage_tracker.choose_mode(client)
+        if mode == MODE_CACHE_ONLY:
+            if self.fallback_backend is self.local_backend:
+                return self.local_backend
+            raise BudgetExhausted("Daily AI token budget exhausted")
+        if mode == MODE_DOWNGRADE and self.fallback_backend is not None:
+            return self.fallback_backend
+        return self.backend
+
+    def generate(self, prompt, request_type="general", client="server", lane=LANE_BACKGROUND):
+        """Return a GenerationResult from the selected backend"""
+        active_backend = self.select(client)
+        if active_backend.uses_upstream:
+            if self.scheduler is not None:
+                with self.scheduler.slot(lane):
+                    result = active_backend.generate(prompt)
+            else:
+                result = active_backend.generate(prompt)
+            self.local_backend.learn(prompt, result.text)
+        else:
+            result = active_backend.generate(prompt)
+        if self.usage_tracker is not None:
+            self.usage_tracker.record(request_type, result.model_name, client, result.input_tokens,
+                                      result.output_tokens, result.estimated, billable=active_backend.uses_upstream)
+        if self.capture is not None:
+            self.capture.note_upstream(prompt, result.text, result.latency_ms, result.model_name)
+        return result
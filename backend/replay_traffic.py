@@ -0,0 +1,134 @@
+"""Replay captured AI traffic against a server and compare latencies.
+
+1. Capture real traffic:
+     AI_CAPTURE_FILE=capture.jsonl python flask_ai_server.py
+2. Start any server variant answering upstream calls from the capture
+   (optionally with AI_PROFILE_FILE=replay.prof to collect cProfile stats):
+     AI_REPLAY_FILE=capture.jsonl python flask_ai_server_corrected.py
+3. Replay the requests at original speed, 2x speed, or back-to-back (0):
+     python replay_traffic.py capture.jsonl --url http://localhost:5050 --speed 2
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from traffic_capture import load_capture
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(latencies):
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies), 1),
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "max_ms": round(max(latencies), 1),
+    }
+
+
+def replay(records, base_url, speed=1.0, workers=32, timeout=60):
+    """Send captured requests at their original offsets divided by speed"""
+    results = []
+    results_lock = threading.Lock()
+    first_ts = records[0]["ts"]
+    replay_started = time.time()
+
+    def send(record):
+        if speed > 0:
+            delay = (record["ts"] - first_ts) / speed - (time.time() - replay_started)
+            if delay > 0:
+                time.sleep(delay)
+        started = time.time()
+        try:
+            response = requests.post(base_url + record["path"], json=record["body"],
+                                     headers=record.get("hdr", {}), timeout=timeout)
+            status = response.status_code
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = {}
+        except requests.exceptions.RequestException as e:
+            status, payload = None, {"error": str(e)}
+        result = {
+            "type": record["body"].get("type", "general"),
+            "original_status": record["st"],
+            "status": status,
+            "original_ms": record["ms"],
+            "replay_ms": round((time.time() - started) * 1000, 1),
+            "fallback": bool(payload.get("fallback")),
+            "stale": bool(payload.get("stale")),
+        }
+        with results_lock:
+            results.append(result)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(send, records))
+    return results
+
+
+def report(results):
+    by_type = {}
+    for result in results:
+        by_type.setdefault(result["type"], []).append(result)
+    summary = {
+        "requests": len(results),
+        "status_mismatches": sum(1 for r in results if r["status"] != r["original_status"]),
+        "fallbacks": sum(1 for r in results if r["fallback"]),
+        "stale": sum(1 for r in results if r["stale"]),
+        "original": summarize([r["original_ms"] for r in results]),
+        "replay": summarize([r["replay_ms"] for r in results]),
+        "by_type": {
+            request_type: {
+                "original": summarize([r["original_ms"] for r in rows]),
+                "replay": summarize([r["replay_ms"] for r in rows]),
+            }
+            for request_type, rows in by_type.items()
+        },
+    }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured AI server traffic")
+    parser.add_argument("capture", help="capture file written with AI_CAPTURE_FILE")
+    parser.add_argument("--url", default="http://localhost:5050", help="server to replay against")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time scale: 1 = original pacing, 2 = twice as fast, 0 = back-to-back")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N requests")
+    parser.add_argument("--workers", type=int, default=32, help="maximum concurrent requests")
+    parser.add_argument("--output", help="write per-request results and the summary as JSON")
+    args = parser.parse_args()
+
+    records = [r for r in load_capture(args.capture) if r.get("k") == "req"]
+    records.sort(key=lambda r: r["ts"])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("❌ No requests found in capture")
+        return
+
+    print(f"Replaying {len(records)} requests against {args.url} at speed {args.speed}...")
+    results = replay(records, args.url.rstrip("/"), args.speed, args.workers)
+    summary = report(results)
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+LANE_INTERACTIVE = "interactive"
+LANE_BACKGROUND = "background"
+
+# Request types answered while a user waits on screen; everything else is background
+INTERACTIVE_TYPES = {"general"}
+
+
+class SchedulerBusy(Exception):
+    """Raised when low-priority work is deferred because upstream capacity is taken"""
+
+
+def lane_for(request_type, priority=None):
+    """Pick a lane from a client-supplied priority, falling back to the request type"""
+    if priority in (LANE_INTERACTIVE, LANE_BACKGROUND):
+        return priority
+    return LANE_INTERACTIVE if request_type in INTERACTIVE_TYPES else LANE_BACKGROUND
+
+
+class RequestScheduler:
+    """Gates upstream model calls by priority lane.
+
+    Settings come from the environment:
+      AI_MAX_CONCURRENCY       - upstream calls in flight across both lanes (default 4)
+      AI_INTERACTIVE_RESERVED  - slots background work may never take (default 2)
+      AI_BACKGROUND_MAX_QUEUE  - waiting background calls before new ones are deferred (default 8)
+      AI_BACKGROUND_MAX_WAIT   - seconds a background call waits before being deferred (default 10)
+      AI_INTERACTIVE_MAX_WAIT  - seconds an interactive call waits before giving up (default 30)
+    Waiting interactive calls always go before waiting background calls.
+    """
+
+    def __init__(self):
+        self.max_concurrency = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+        self.interactive_reserved = min(int(os.getenv("AI_INTERACTIVE_RESERVED", "2")), self.max_concurrency)
+        self.background_max_queue = int(os.getenv("AI_BACKGROUND_MAX_QUEUE", "8"))
+        self.max_wait = {
+            LANE_INTERACTIVE: float(os.getenv("AI_INTERACTIVE_MAX_WAIT", "30")),
+            LANE_BACKGROUND: float(os.getenv("AI_BACKGROUND_MAX_WAIT", "10")),
+        }
+        self._cond = threading.Condition()
+        self._active = {LANE_INTERACTIVE: 0, LANE_BACKGROUND: 0}
+        self._waiting = {LANE_INTERACTIVE: 0, LANE_BACKGROUND: 0}
+        self._stats = {
+            lane: {"completed": 0, "deferred": 0, "wait_total": 0.0, "wait_max": 0.0,
+                   "recent_waits": deque(maxlen=200)}
+            for lane in (LANE_INTERACTIVE, LANE_BACKGROUND)
+        }
+
+    def _can_start(self, lane):
+        total_active = sum(self._active.values())
+        if total_active >= self.max_concurrency:
+            return False
+        if lane == LANE_INTERACTIVE:
+            return True
+        background_limit = self.max_concurrency - self.interactive_reserved
+        return self._waiting[LANE_INTERACTIVE] == 0 and self._active[LANE_BACKGROUND] < background_limit
+
+    @contextmanager
+    def slot(self, lane):
+        """Hold an upstream slot in the given lane for the duration of the block"""
+        started = time.time()
+        with self._cond:
+            if lane == LANE_BACKGROUND and self._waiting[lane] >= self.background_max_queue:
+                self._stats[lane]["deferred"] += 1
+                raise SchedulerBusy("Background queue is full")
+            self._waiting[lane] += 1
+            try:
+                deadline = started + self.max_wait[lane]
+                while not self._can_start(lane):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._stats[lane]["deferred"] += 1
+                        raise SchedulerBusy(f"No upstream capacity for {lane} request")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting[lane] -= 1
+                # A departing interactive waiter may unblock background work
+                self._cond.notify_all()
+            self._active[lane] += 1
+            waited = time.time() - started
+            stats = self._stats[lane]
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+            stats["recent_waits"].append(waited)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[lane] -= 1
+                self._stats[lane]["completed"] += 1
+                self._cond.notify_all()
+
+    def metrics(self):
+        with self._cond:
+            lanes = {}
+            for lane, stats in self._stats.items():
+                recent = sorted(stats["recent_waits"])
+                started = stats["completed"] + self._active[lane]
+                lanes[lane] = {
+                    "queue_depth": self._waiting[lane],
+                    "active": self._active[lane],
+                    "completed": stats["completed"],
+                    "deferred": stats["deferred"],
+                    "avg_wait_ms": round(stats["wait_total"] / started * 1000, 1) if started else 0.0,
+                    "p95_wait_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 1) if recent else 0.0,
+                    "max_wait_ms": round(stats["wait_max"] * 1000, 1),
+                }
+            return {
+                "max_concurrency": self.max_concurrency,
+                "interactive_reserved": self.interactive_reserved,
+                "lanes": lanes,
+            }
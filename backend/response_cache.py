@@ -0,0 +1,123 @@
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class ResponseCache:
+    """Keeps the last good AI response per request so it can be served stale
+    while a fresh one is fetched in the background.
+
+    AI_STALE_AFTER sets how many seconds a request waits for a fresh answer
+    before a stored one is served instead (default 4, 0 waits indefinitely).
+    """
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self.stale_after = float(os.getenv("AI_STALE_AFTER", "4"))
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(request_type, query):
+        """Equivalent requests share a key: same type, same query ignoring case and spacing"""
+        normalized = " ".join(str(query).lower().split())
+        return hashlib.sha256(f"{request_type}:{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries[key] = {"response": response, "stored_at": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh_async(self, key, generate):
+        """Run generate() in a background thread and store its result under key.
+
+        Only one refresh per key runs at a time; failures keep the stale entry.
+        Returns True if a new refresh was started.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+
+        def worker():
+            try:
+                fresh = generate()
+                if fresh:
+                    self.put(key, fresh)
+                    print(f"Background refresh succeeded for {key[:12]}")
+            except Exception as refresh_error:
+                print(f"Background refresh failed for {key[:12]}: {refresh_error}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=worker, daemon=True).start()
+        return True
+
+    def fetch(self, key, generate):
+        """Return (response, stale_entry) for a fresh call to generate().
+
+        The result is stored under key. If an entry is already stored and
+        generate() takes longer than stale_after, (None, entry) is returned
+        and the call carries on in the background as the refresh; while it
+        runs, further requests for key get the entry without a new call.
+        Errors from generate() before the deadline are raised.
+        """
+        entry = self.get(key)
+        if entry is None or self.stale_after <= 0:
+            response = generate()
+            if response:
+                self.put(key, response)
+            return response, None
+
+        with self._lock:
+            if key in self._refreshing:
+                return None, entry
+            self._refreshing.add(key)
+
+        future = Future()
+        # Keep the caller's context (e.g. Flask's request context) in the worker
+        context = contextvars.copy_context()
+
+        def worker():
+            try:
+                fresh = context.run(generate)
+                if fresh:
+                    self.put(key, fresh)
+                future.set_result(fresh)
+            except Exception as fetch_error:
+                future.set_exception(fetch_error)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=worker, daemon=True).start()
+        try:
+            return future.result(timeout=self.stale_after), None
+        except TimeoutError:
+            print(f"No fresh response for {key[:12]} after {self.stale_after}s, serving stale")
+            future.add_done_callback(self._report_refresh(key))
+            return None, entry
+
+    @staticmethod
+    def _report_refresh(key):
+        def report(future):
+            if future.exception() is not None:
+                print(f"Background refresh failed for {key[:12]}: {future.exception()}")
+            else:
+                print(f"Background refresh succeeded for {key[:12]}")
+        return report
@@ -0,0 +1,112 @@
+from analysis_sessions import AnalysisSessions
+
+
+def context(*meals, age=30):
+    return {"foodLogs": [dict(meal) for meal in meals], "profile": {"age": age}}
+
+
+RICE = {"item": "Rice", "calories": 200}
+EGG = {"item": "Egg", "calories": 80}
+CAKE = {"item": "Cake", "calories": 500}
+
+
+def analysed(sessions, ctx, response="NO_ALERTS_NEEDED", session_id="user:1"):
+    plan = sessions.plan(session_id, ctx)
+    sessions.commit(session_id, plan, response)
+    return plan
+
+
+def test_first_call_is_a_full_analysis():
+    plan = AnalysisSessions().plan("user:1", context(RICE))
+    assert plan["mode"] == "full"
+    assert plan["previous_response"] is None
+    assert '"Rice"' in plan["prompt_context"]
+
+
+def test_same_context_is_unchanged():
+    sessions = AnalysisSessions()
+    analysed(sessions, context(RICE, EGG), "ALERTS")
+    plan = sessions.plan("user:1", context(RICE, EGG))
+    assert plan["mode"] == "unchanged"
+    assert plan["previous_response"] == "ALERTS"
+
+
+def test_reordered_entries_are_unchanged():
+    sessions = AnalysisSessions()
+    analysed(sessions, context(RICE, EGG))
+    assert sessions.plan("user:1", context(EGG, RICE))["mode"] == "unchanged"
+
+
+def test_new_entry_is_sent_as_delta():
+    sessions = AnalysisSessions()
+    analysed(sessions, context(RICE), "ALERTS")
+    plan = sessions.plan("user:1", context(RICE, CAKE))
+    assert plan["mode"] == "delta"
+    assert plan["new_entries"] == {"foodLogs": [CAKE]}
+    assert plan["dropped_entries"] == {}
+    assert "Previous alerts: ALERTS" in plan["prompt_context"]
+    assert '"Rice"' not in plan["prompt_context"]
+
+
+def test_duplicate_entries_each_count():
+    sessions = AnalysisSessions()
+    analysed(sessions, context(RICE))
+    plan = sessions.plan("user:1", context(RICE, RICE))
+    assert plan["mode"] == "delta"
+    assert plan["new_entries"] == {"foodLogs": [RICE]}
+    sessions.commit("user:1", plan, "NO_ALERTS_NEEDED")
+    assert sessions.plan("user:1", context(RICE, RICE))["mode"] == "unchanged"
+
+
+def test_dropped_entry_is_sent_as_delta_and_leaves_the_summary():
+    sessions = AnalysisSessions()
+    analysed(sessions, context(RICE, EGG))
+    plan = sessions.plan("user:1", context(EGG, CAKE))
+    assert plan["mode"] == "delta"
+    assert plan["new_entries"] == {"foodLogs": [CAKE]}
+    assert plan["dropped_entries"] == {"foodLogs": [RICE]}
+    assert plan["summary"] == {"foodLogs": {"count": 1, "totals": {"calories": 80}}}
+    assert "Entries no longer in the window" in plan["prompt_context"]
+
+    sessions.commit("user:1", plan, "NO_ALERTS_NEEDED")
+    plan = sessions.plan("user:1", context(CAKE))
+    assert plan["mode"] == "delta"
+    assert plan["new_entries"] == {}
+    assert plan["dropped_entries"] == {"foodLogs": [EGG]}
+    assert plan["summary"] == {"foodLogs": {"count": 1, "totals": {"calories": 500}}}
+
+
+def test_one_of_two_duplicates_dropping_out():
+    sessions = AnalysisSessions()
+    analysed(sessions, context(RICE, RICE))
+    plan = sessions.plan("user:1", context(RICE))
+    assert plan["mode"] == "delta"
+    assert plan["dropped_entries"] == {"foodLogs": [RICE]}
+    assert plan["summary"]["foodLogs"]["count"] == 1
+
+
+def test_changed_profile_forces_full_analysis():
+    sessions = AnalysisSessions()
+    analysed(sessions, context(RICE, age=30), "ALERTS")
+    plan = sessions.plan("user:1", context(RICE, CAKE, age=31))
+    assert plan["mode"] == "full"
+    assert plan["previous_response"] == "ALERTS"
+
+
+def test_uncommitted_plan_is_not_remembered():
+    sessions = AnalysisSessions()
+    analysed(sessions, context(RICE))
+    sessions.plan("user:1", context(RICE, CAKE))
+    plan = sessions.plan("user:1", context(RICE, CAKE))
+    assert plan["mode"] == "delta"
+    assert plan["new_entries"] == {"foodLogs": [CAKE]}
+
+
+def test_sessions_are_separate_and_bounded():
+    sessions = AnalysisSessions(max_sessions=2)
+    analysed(sessions, context(RICE), session_id="user:1")
+    analysed(sessions, context(RICE), session_id="user:2")
+    assert sessions.plan("user:3", context(RICE))["mode"] == "full"
+    analysed(sessions, context(RICE), session_id="user:3")
+    assert sessions.plan("user:1", context(RICE))["mode"] == "full"
+    assert sessions.plan("user:3", context(RICE))["mode"] == "unchanged"
@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import ExitStack
+
+import pytest
+
+from request_scheduler import (LANE_BACKGROUND, LANE_INTERACTIVE, RequestScheduler, SchedulerBusy,
+                               lane_for)
+
+
+@pytest.fixture
+def make_scheduler(monkeypatch):
+    def make(max_concurrency=2, reserved=1, background_queue=8, background_wait=0.05, interactive_wait=0.05):
+        monkeypatch.setenv("AI_MAX_CONCURRENCY", str(max_concurrency))
+        monkeypatch.setenv("AI_INTERACTIVE_RESERVED", str(reserved))
+        monkeypatch.setenv("AI_BACKGROUND_MAX_QUEUE", str(background_queue))
+        monkeypatch.setenv("AI_BACKGROUND_MAX_WAIT", str(background_wait))
+        monkeypatch.setenv("AI_INTERACTIVE_MAX_WAIT", str(interactive_wait))
+        return RequestScheduler()
+    return make
+
+
+def test_lane_for_uses_priority_then_request_type():
+    assert lane_for("general") == LANE_INTERACTIVE
+    assert lane_for("suggestions") == LANE_BACKGROUND
+    assert lane_for("health_analysis") == LANE_BACKGROUND
+    assert lane_for("health_analysis", "interactive") == LANE_INTERACTIVE
+    assert lane_for("general", "bogus") == LANE_INTERACTIVE
+
+
+def test_reserved_slots_stay_free_for_interactive(make_scheduler):
+    scheduler = make_scheduler(max_concurrency=2, reserved=1)
+    with scheduler.slot(LANE_BACKGROUND):
+        with pytest.raises(SchedulerBusy):
+            with scheduler.slot(LANE_BACKGROUND):
+                pass
+        with scheduler.slot(LANE_INTERACTIVE):
+            assert scheduler.metrics()["lanes"][LANE_INTERACTIVE]["active"] == 1
+
+
+def test_interactive_waits_when_every_slot_is_taken(make_scheduler):
+    scheduler = make_scheduler(max_concurrency=2, reserved=1)
+    with ExitStack() as held:
+        held.enter_context(scheduler.slot(LANE_INTERACTIVE))
+        held.enter_context(scheduler.slot(LANE_INTERACTIVE))
+        with pytest.raises(SchedulerBusy):
+            with scheduler.slot(LANE_INTERACTIVE):
+                pass
+
+
+def test_full_background_queue_defers_immediately(make_scheduler):
+    scheduler = make_scheduler(background_queue=0, background_wait=5)
+    started = time.time()
+    with pytest.raises(SchedulerBusy):
+        with scheduler.slot(LANE_BACKGROUND):
+            pass
+    assert time.time() - started < 1
+    assert scheduler.metrics()["lanes"][LANE_BACKGROUND]["deferred"] == 1
+
+
+def test_waiting_interactive_call_goes_before_background(make_scheduler):
+    scheduler = make_scheduler(max_concurrency=1, reserved=0, background_wait=2, interactive_wait=2)
+    order = []
+
+    def run(lane):
+        with scheduler.slot(lane):
+            order.append(lane)
+
+    with scheduler.slot(LANE_INTERACTIVE):
+        background = threading.Thread(target=run, args=(LANE_BACKGROUND,))
+        background.start()
+        while scheduler.metrics()["lanes"][LANE_BACKGROUND]["queue_depth"] == 0:
+            time.sleep(0.001)
+        interactive = threading.Thread(target=run, args=(LANE_INTERACTIVE,))
+        interactive.start()
+        while scheduler.metrics()["lanes"][LANE_INTERACTIVE]["queue_depth"] == 0:
+            time.sleep(0.001)
+    background.join()
+    interactive.join()
+    assert order == [LANE_INTERACTIVE, LANE_BACKGROUND]
+
+
+def test_metrics_count_completed_deferred_and_waits(make_scheduler):
+    scheduler = make_scheduler(max_concurrency=1, reserved=0, background_wait=0.02)
+    with scheduler.slot(LANE_INTERACTIVE):
+        with pytest.raises(SchedulerBusy):
+            with scheduler.slot(LANE_BACKGROUND):
+                pass
+    with scheduler.slot(LANE_BACKGROUND):
+        pass
+
+    metrics = scheduler.metrics()
+    assert metrics["max_concurrency"] == 1
+    assert metrics["interactive_reserved"] == 0
+    interactive = metrics["lanes"][LANE_INTERACTIVE]
+    background = metrics["lanes"][LANE_BACKGROUND]
+    assert (interactive["completed"], interactive["deferred"], interactive["active"]) == (1, 0, 0)
+    assert (background["completed"], background["deferred"], background["active"]) == (1, 1, 0)
+    assert background["queue_depth"] == 0
+    assert background["max_wait_ms"] >= 0.0
+
+
+def test_slot_is_released_when_the_call_fails(make_scheduler):
+    scheduler = make_scheduler(max_concurrency=1, reserved=0)
+    with pytest.raises(ValueError):
+        with scheduler.slot(LANE_INTERACTIVE):
+            raise ValueError("upstream error")
+    with scheduler.slot(LANE_INTERACTIVE):
+        pass
+    assert scheduler.metrics()["lanes"][LANE_INTERACTIVE]["completed"] == 2
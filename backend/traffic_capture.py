@@ -0,0 +1,274 @@
+import atexit
+import cProfile
+import hashlib
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from flask import g, has_request_context, request
+
+from analysis_sessions import resolve_client_id
+from llm_backends import infer_request_type
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# International numbers need a leading "+"; otherwise only 3-3-4 groupings such
+# as (555) 123-4567 count, so dates and runs of values are left alone
+PHONE_RE = re.compile(
+    r"(?<![\w+])\+\d{1,3}(?:[\s.-]?\(?\d{1,4}\)?){2,5}(?![\w-])"
+    r"|(?<![\w-])(?:\(\d{3}\)\s?|\d{3}[\s.-])\d{3}[\s.-]\d{4}(?![\w-])"
+)
+
+
+def scrub_pii(value):
+    """Replace emails and phone-like numbers in strings, recursively"""
+    if isinstance(value, str):
+        return PHONE_RE.sub("[phone]", EMAIL_RE.sub("[email]", value))
+    if isinstance(value, list):
+        return [scrub_pii(item) for item in value]
+    if isinstance(value, dict):
+        return {key: scrub_pii(item) for key, item in value.items()}
+    return value
+
+
+def prompt_hash(prompt):
+    """Key for a captured upstream response: a hash of the exact prompt text"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:32]
+
+
+class TrafficCapture:
+    """Opt-in capture of AI requests, timings and upstream responses for replay.
+
+    Enabled by the environment:
+      AI_CAPTURE_FILE       - JSON Lines file to append to (capture is off when unset)
+      AI_CAPTURE_MAX_BYTES  - size at which the file rotates to <file>.1 (default 50 MB)
+      AI_CAPTURE_ANONYMIZE  - comma list of: ids (hash client/session ids), pii (scrub
+                              emails and phone numbers), text (drop query/context text).
+                              Default "ids,pii". Captures made with "text" cannot be replayed.
+      AI_PROFILE_FILE       - if set, cProfile every captured route and dump pstats here at exit.
+                              One profiler serves the process, so profiled requests run one
+                              at a time.
+    """
+
+    def __init__(self, path=None, max_bytes=50 * 1024 * 1024, anonymize=("ids", "pii"),
+                 paths=("/api/ai/health-advice",), profile_path=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.anonymize = set(anonymize)
+        self.paths = set(paths)
+        self.profile_path = profile_path
+        self.salt = os.urandom(8).hex()
+        self._lock = threading.Lock()
+        self._file = None
+        # cProfile allows one active profiler (sys.monitoring on Python 3.12+),
+        # so requests share this one and take turns
+        self._profiler = cProfile.Profile() if profile_path else None
+        self._profile_lock = threading.Lock()
+        self._profiled = 0
+        if profile_path:
+            atexit.register(self.dump_profile)
+
+    @classmethod
+    def from_env(cls):
+        anonymize = [mode.strip() for mode in os.getenv("AI_CAPTURE_ANONYMIZE", "ids,pii").split(",") if mode.strip()]
+        return cls(
+            path=os.getenv("AI_CAPTURE_FILE") or None,
+            max_bytes=int(os.getenv("AI_CAPTURE_MAX_BYTES", str(50 * 1024 * 1024))),
+            anonymize=anonymize,
+            profile_path=os.getenv("AI_PROFILE_FILE") or None,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def install(self, app):
+        """Register request hooks on a Flask app"""
+        if not (self.enabled or self.profile_path):
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        if self.enabled:
+            print(f"Capturing AI traffic to {self.path} (anonymize: {','.join(sorted(self.anonymize)) or 'off'})")
+        if self.profile_path:
+            print(f"Profiling AI requests to {self.profile_path}")
+
+    def _tracked(self):
+        return request.method == "POST" and request.path in self.paths
+
+    def _before_request(self):
+        if not self._tracked():
+            return
+        if self._profiler is not None:
+            self._profile_lock.acquire()
+            g.capture_profiling = True
+            self._profiler.enable()
+        g.capture_started = time.time()
+        g.capture_upstream = []
+
+    def _after_request(self, response):
+        if not self._tracked() or "capture_started" not in g:
+            return response
+        latency_ms = (time.time() - g.capture_started) * 1000
+        if self.enabled:
+            body = request.get_json(silent=True) or {}
+            self._write({
+                "k": "req",
+                "ts": round(g.capture_started, 3),
+                "path": request.path,
+                "body": self._anonymize_body(body),
+                "hdr": self._anonymize_headers(),
+                "st": response.status_code,
+                "ms": round(latency_ms, 1),
+                "up": g.capture_upstream,
+            })
+        return response
+
+    def _teardown_request(self, exc):
+        # Runs even when the request failed, so the profiler is always handed back
+        if g.pop("capture_profiling", False):
+            self._profiler.disable()
+            self._profiled += 1
+            self._profile_lock.release()
+
+    def note_upstream(self, prompt, text, latency_ms, model_name):
+        """Record an upstream model response for the current request"""
+        if not self.enabled or not has_request_context() or "capture_upstream" not in g:
+            return
+        # Hash the prompt a replay will rebuild: from the scrubbed body when PII is scrubbed
+        replay_prompt = scrub_pii(prompt) if "pii" in self.anonymize else prompt
+        upstream = {
+            "ph": prompt_hash(replay_prompt),
+            "m": model_name,
+            "ms": round(latency_ms, 1),
+            "r": scrub_pii(text) if "pii" in self.anonymize else text,
+        }
+        # Prompts let the local backend learn from a capture
+        if "text" not in self.anonymize:
+            upstream["p"] = replay_prompt
+        g.capture_upstream.append(upstream)
+
+    def _hash_id(self, value):
+        return hashlib.sha256(f"{self.salt}:{value}".encode("utf-8")).hexdigest()[:16]
+
+    def _anonymize_body(self, body):
+        body = dict(body)
+        if "ids" in self.anonymize and body.get("session_id"):
+            body["session_id"] = self._hash_id(body["session_id"])
+        if "text" in self.anonymize:
+            for field in ("query", "context"):
+                if field in body:
+                    body[field] = f"[{len(json.dumps(body[field], default=str))} chars]"
+        elif "pii" in self.anonymize:
+            body = scrub_pii(body)
+        return body
+
+    def _anonymize_headers(self):
+        client = resolve_client_id(request.headers.get("Authorization"), request.remote_addr)
+        return {"X-Client-Id": self._hash_id(client) if "ids" in self.anonymize else client}
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        data = line.encode("utf-8")
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "ab")
+                if self._file.tell() + len(data) > self.max_bytes:
+                    self._file.close()
+                    os.replace(self.path, self.path + ".1")
+                    self._file = open(self.path, "ab")
+                self._file.write(data)
+                self._file.flush()
+            except Exception as write_error:
+                print(f"Could not write capture record: {write_error}")
+
+    def dump_profile(self):
+        with self._profile_lock:
+            if self._profiled:
+                pstats.Stats(self._profiler).dump_stats(self.profile_path)
+                print(f"Profile written to {self.profile_path}")
+
+
+def load_capture(path):
+    """Read capture records, skipping a truncated last line"""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+class _ReplayPart:
+    def __init__(self, text):
+        self.text = text
+
+
+class _ReplayContent:
+    def __init__(self, text):
+        self.parts = [_ReplayPart(text)]
+
+
+class _ReplayCandidate:
+    def __init__(self, text):
+        self.content = _ReplayContent(text)
+
+
+class ReplayResponse:
+    """Mimics the parts of a Gemini response the servers read"""
+
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [_ReplayCandidate(text)]
+        self.usage_metadata = None
+
+
+class ReplayModel:
+    """Stands in for a Gemini model, answering from a capture file.
+
+    Responses are looked up by a hash of the exact prompt and returned after the captured
+    upstream latency divided by speed (speed 0 returns immediately). Another
+    server variant words its prompts differently, so on a miss the next
+    captured response of the same request type is served instead.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.model_name = "replay"
+        self.speed = speed
+        self.misses = 0
+        self.type_matches = 0
+        self._responses = {}
+        self._by_type = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+        for record in load_capture(path):
+            request_type = record.get("body", {}).get("type", "general")
+            for upstream in record.get("up", []):
+                captured = (upstream["r"], upstream["ms"])
+                self._responses.setdefault(upstream["ph"], []).append(captured)
+                self._by_type.setdefault(request_type, []).append(captured)
+        print(f"Loaded {sum(len(v) for v in self._responses.values())} captured responses from {path}")
+
+    def generate_content(self, prompt, stream=False):
+        key = prompt_hash(prompt)
+        with self._lock:
+            captured = self._responses.get(key)
+            if not captured:
+                request_type = infer_request_type(prompt)
+                captured = self._by_type.get(request_type)
+                if not captured:
+                    self.misses += 1
+                    raise Exception(f"No captured response for prompt {key}")
+                self.type_matches += 1
+                key = f"type:{request_type}"
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            text, latency_ms = captured[position % len(captured)]
+        if self.speed > 0:
+            time.sleep(latency_ms / 1000 / self.speed)
+        return [ReplayResponse(text)] if stream else ReplayResponse(text)
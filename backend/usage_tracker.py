@@ -0,0 +1,182 @@
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import date
+
+# Approximate USD prices per 1M tokens (input, output). Update as pricing changes.
+MODEL_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-flash-latest": (0.075, 0.30),
+    "gemini-1.5-flash-8b": (0.0375, 0.15),
+    "gemini-pro": (0.50, 1.50),
+    "local": (0.0, 0.0),
+}
+
+MODE_PRIMARY = "primary"
+MODE_DOWNGRADE = "downgrade"
+MODE_CACHE_ONLY = "cache_only"
+
+
+class BudgetExhausted(Exception):
+    """Raised when the daily token budget leaves only cache-only mode"""
+
+
+def _env_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) when the model gives no usage data"""
+    return max(1, len(text or "") // 4)
+
+
+def extract_usage(response, prompt, output_text):
+    """Return (input_tokens, output_tokens, estimated) for a Gemini response"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and getattr(usage, "prompt_token_count", None) is not None:
+        return usage.prompt_token_count, getattr(usage, "candidates_token_count", 0) or 0, False
+    return estimate_tokens(prompt), estimate_tokens(output_text), True
+
+
+class UsageTracker:
+    """Aggregates token usage and cost per day by request type, model and client.
+
+    Budgets are read from the environment:
+      AI_DAILY_TOKEN_BUDGET        - tokens per day across all clients
+      AI_CLIENT_DAILY_TOKEN_BUDGET - tokens per day for a single client
+      AI_BUDGET_DOWNGRADE_AT       - fraction of a budget after which the cheaper model is used (default 0.8)
+    Once a budget is fully spent, requests are served from cache only.
+    """
+
+    def __init__(self, path, retain_days=30, save_interval=5.0):
+        self.path = path
+        self.retain_days = retain_days
+        self.save_interval = save_interval
+        self.daily_budget = _env_int("AI_DAILY_TOKEN_BUDGET")
+        self.client_daily_budget = _env_int("AI_CLIENT_DAILY_TOKEN_BUDGET")
+        self.downgrade_at = float(os.getenv("AI_BUDGET_DOWNGRADE_AT", "0.8"))
+        self._days = {}
+        self._lock = threading.Lock()
+        # Serializes writers of the shared .tmp file
+        self._save_lock = threading.Lock()
+        self._last_save = 0.0
+        # Only a process that recorded usage saves, so an idle one (e.g. the
+        # Werkzeug reloader parent) cannot overwrite newer counters at exit
+        self._dirty = False
+        self._load()
+        atexit.register(self.save)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                self._days = json.load(f).get("days", {})
+        except FileNotFoundError:
+            pass
+        except Exception as load_error:
+            print(f"Could not load usage stats from {self.path}: {load_error}")
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                payload = json.dumps({"days": self._days}, indent=2)
+                self._dirty = False
+                self._last_save = time.time()
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.path)
+            except Exception as save_error:
+                with self._lock:
+                    self._dirty = True
+                print(f"Could not save usage stats to {self.path}: {save_error}")
+
+    def _today(self):
+        today = date.today().isoformat()
+        if today not in self._days:
+            self._days[today] = {"totals": {}, "clients": {}, "breakdown": []}
+            for old_day in sorted(self._days)[:-self.retain_days]:
+                del self._days[old_day]
+        return self._days[today]
+
+    @staticmethod
+    def cost(model_name, input_tokens, output_tokens):
+        name = model_name.split("/")[-1]
+        input_price, output_price = MODEL_PRICES.get(name, (0.0, 0.0))
+        return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def record(self, request_type, model_name, client, input_tokens, output_tokens, estimated=False, billable=True):
+        """Add one response to today's counters; non-billable calls (e.g. the
+        local backend) are listed in the breakdown but never spend budget"""
+        cost = self.cost(model_name, input_tokens, output_tokens) if billable else 0.0
+        with self._lock:
+            day = self._today()
+            entry = None
+            for row in day["breakdown"]:
+                if row["type"] == request_type and row["model"] == model_name and row["client"] == client:
+                    entry = row
+                    break
+            if entry is None:
+                entry = {"type": request_type, "model": model_name, "client": client,
+                         "requests": 0, "input_tokens": 0, "output_tokens": 0,
+                         "estimated_requests": 0, "cost_usd": 0.0}
+                day["breakdown"].append(entry)
+            entry["requests"] += 1
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+            entry["estimated_requests"] += 1 if estimated else 0
+            entry["cost_usd"] += cost
+
+            totals = day["totals"]
+            totals["requests"] = totals.get("requests", 0) + 1
+            if billable:
+                totals["tokens"] = totals.get("tokens", 0) + input_tokens + output_tokens
+                totals["cost_usd"] = totals.get("cost_usd", 0.0) + cost
+                day["clients"][client] = day["clients"].get(client, 0) + input_tokens + output_tokens
+            self._dirty = True
+            due = time.time() - self._last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def _budget_fraction(self, client):
+        with self._lock:
+            day = self._today()
+            fractions = [0.0]
+            if self.daily_budget:
+                fractions.append(day["totals"].get("tokens", 0) / self.daily_budget)
+            if self.client_daily_budget and client is not None:
+                fractions.append(day["clients"].get(client, 0) / self.client_daily_budget)
+        return max(fractions)
+
+    def choose_mode(self, client=None):
+        """Pick primary, downgrade or cache_only depending on how much budget is left"""
+        fraction = self._budget_fraction(client)
+        if fraction >= 1.0:
+            return MODE_CACHE_ONLY
+        if fraction >= self.downgrade_at:
+            return MODE_DOWNGRADE
+        return MODE_PRIMARY
+
+    def snapshot(self):
+        with self._lock:
+            day = self._today()
+            today = json.loads(json.dumps(day))
+            history = {d: v["totals"] for d, v in self._days.items()}
+        return {
+            "date": date.today().isoformat(),
+            "today": today,
+            "history": history,
+            "budgets": {
+                "daily_tokens": self.daily_budget,
+                "client_daily_tokens": self.client_daily_budget,
+                "downgrade_at": self.downgrade_at,
+            },
+            "mode": self.choose_mode(),
+        }
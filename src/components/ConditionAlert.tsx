@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from "react";
 import { AlertCircle, Activity, CheckCircle } from "lucide-react";
+import { useAuth } from "@/contexts/AuthContext";
 
 interface Alert {
   type: "alert" | "info" | "success";
@@ -23,17 +24,54 @@ function parseHealthAlerts(aiResponse: string): Alert[] {
 
   const alerts: Alert[] = [];
 
+  if (aiResponse.trim() === "NO_ALERTS_NEEDED") {
+    return [
+      {
+        type: "success",
+        message: "No critical health issues detected.",
+        recommendation: "Maintain your healthy habits.",
+      },
+    ];
+  }
+
   // Example: AI outputs line-based recommendations
   const lines = aiResponse.split("\n").map((line) => line.trim());
 
   lines.forEach((line) => {
     if (line.includes("|")) {
-      const [msg, rec] = line.split("|").map((s) => s.trim());
-      alerts.push({
-        type: line.toLowerCase().includes("alert") ? "alert" : "info",
-        message: msg,
-        recommendation: rec || undefined,
-      });
+      const fields = line.split("|").map((s) => s.trim());
+      // Skip an echoed format header
+      if (fields[0].toUpperCase() === "ALERT_TYPE") return;
+
+      if (fields.length >= 6) {
+        // ALERT_TYPE|CATEGORY|SEVERITY|TITLE|MESSAGE|RECOMMENDATIONS
+        const [alertType, , severity, title, message, ...recs] = fields;
+        const kind = alertType.toLowerCase();
+        const level = severity.toLowerCase();
+        alerts.push({
+          type:
+            kind === "success"
+              ? "success"
+              : kind === "warning" || kind === "danger" || level === "high" || level === "critical"
+              ? "alert"
+              : "info",
+          message: title && message ? `${title}: ${message}` : title || message,
+          recommendation:
+            recs
+              .join("|")
+              .split(";")
+              .map((r) => r.trim())
+              .filter(Boolean)
+              .join("; ") || undefined,
+        });
+      } else {
+        const [msg, rec] = fields;
+        alerts.push({
+          type: line.toLowerCase().includes("alert") ? "alert" : "info",
+          message: msg,
+          recommendation: rec || undefined,
+        });
+      }
     } else if (line.length > 0) {
       alerts.push({
         type: "info",
@@ -55,15 +93,26 @@ function parseHealthAlerts(aiResponse: string): Alert[] {
 }
 
 // ✅ AI Integration with better safety
-async function analyzeHealthWithAI(healthData: any): Promise<Alert[]> {
+// The server keeps a per-user session (keyed by the auth token) and only
+// sends new entries to the model
+async function analyzeHealthWithAI(
+  healthData: any,
+  sessionId?: string
+): Promise<Alert[]> {
   try {
+    const token = localStorage.getItem("authToken");
     const response = await fetch("http://localhost:5050/api/ai/health-advice", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: {
+        "Content-Type": "application/json",
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
       body: JSON.stringify({
         query:
           "As a health AI analyst, analyze this user's health patterns and provide specific alerts if needed.",
+        type: "health_analysis",
         context: healthData,
+        session_id: sessionId,
       }),
     });
 
@@ -117,17 +166,21 @@ async function getCurrentHealthData() {
 }
 
 const ConditionAlert: React.FC = () => {
+  const { user, loading: authLoading } = useAuth();
   const [alerts, setAlerts] = useState<Alert[]>([]);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
+    // Wait for auth to settle so the analysis runs once, under the right session
+    if (authLoading) return;
+
     const analyze = async () => {
       setLoading(true);
       try {
         const healthData = await getCurrentHealthData();
         console.log("📊 Current Health Data:", healthData);
 
-        const aiAlerts = await analyzeHealthWithAI(healthData);
+        const aiAlerts = await analyzeHealthWithAI(healthData, user?.id);
         setAlerts(aiAlerts);
       } catch (error) {
         console.error("❌ Error analyzing health:", error);
@@ -137,7 +190,7 @@ const ConditionAlert: React.FC = () => {
     };
 
     analyze();
-  }, []);
+  }, [authLoading, user?.id]);
 
   if (loading) {
     return (